@@ -2,6 +2,10 @@
 DOTENV_PATH = "env/analyst.env"
 MAX_DOCUMENTS = 10
 MAX_DOCUMENT_CHARS = 200000
+# 文献読み込みを並列化する条件（未キャッシュのファイル数または合計バイト数）と最大ワーカー数
+PARALLEL_LOAD_MIN_FILES = 16
+PARALLEL_LOAD_MIN_BYTES = 20 * 1024 * 1024
+PARALLEL_LOAD_MAX_WORKERS = 4
 
 # --- 環境変数キー名 ---
 MODEL_NAMES_KEY = "MODEL_NAMES"
@@ -1,118 +1,361 @@
 import os
+import re
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import threading
 import fitz  # PyMuPDF
 import docx
+import charset_normalizer
 from pathlib import Path
 from paper_analyst import config
 
+def _build_nonprintable_pattern() -> re.Pattern:
+    """
+    除去対象（表示不可能かつ空白でない文字）にマッチする正規表現を作成する。
+    起動時に全コードポイントを一度だけ走査し、連続するコードポイントを範囲にまとめる
+    （全面でも数百個の範囲に収まる）。
+    """
+    ranges = []
+    for cp in range(sys.maxunicode + 1):
+        ch = chr(cp)
+        if ch.isprintable() or ch.isspace():
+            continue
+        if ranges and ranges[-1][1] == cp - 1:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    char_class = "".join(
+        re.escape(chr(start)) if start == end else f"{re.escape(chr(start))}-{re.escape(chr(end))}"
+        for start, end in ranges
+    )
+    return re.compile(f"[{char_class}]+")
+
+_NONPRINTABLE_RE = _build_nonprintable_pattern()
+
 def _sanitize_text(text: str) -> str:
     """
     Streamlitの内部プロトコルで問題を起こしうる文字をサニタイズする。
     制御文字や一部の特殊な空白文字などを除去する。
     """
-    sanitized_text = "".join(ch for ch in text if ch.isprintable() or ch.isspace())
-    sanitized_text = sanitized_text.replace('\u0000', '')
-    sanitized_text = sanitized_text.replace('\u2028', '\n')
-    sanitized_text = sanitized_text.replace('\u2029', '\n')
+    sanitized_text = _NONPRINTABLE_RE.sub("", text)
+    # 行区切り・段落区切りは改行に置換する
+    if not sanitized_text.isascii():
+        sanitized_text = sanitized_text.replace("\u2028", "\n").replace("\u2029", "\n")
     return sanitized_text
 
-def _read_pdf(file_path: Path) -> (str, bool):
-    """PDFファイルからテキストを抽出する。テキストの有無も判定する。"""
+def _read_pdf(file_path: Path) -> (list, bool):
+    """
+    PDFファイルからテキストを抽出する。テキストの有無も判定する。
+    ページ単位でサニタイズし、最大文字数を超える手前で分割したパートのリストを返す。
+    """
     try:
         doc = fitz.open(file_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
-        is_text_extracted = text.strip() != ""
-        return text.strip(), is_text_extracted
+        try:
+            parts = []
+            buffer = []
+            buffer_length = 0
+            for page in doc:
+                page_text = _sanitize_text(page.get_text())
+                if buffer and buffer_length + len(page_text) > config.MAX_DOCUMENT_CHARS:
+                    parts.append("".join(buffer))
+                    buffer = []
+                    buffer_length = 0
+                if len(page_text) > config.MAX_DOCUMENT_CHARS:
+                    # 1ページで最大文字数を超える場合はページ内で分割する
+                    parts.extend(_split_text(page_text, config.MAX_DOCUMENT_CHARS))
+                    continue
+                buffer.append(page_text)
+                buffer_length += len(page_text)
+            if buffer:
+                parts.append("".join(buffer))
+        finally:
+            doc.close()
+        parts = [part.strip() for part in parts]
+        parts = [part for part in parts if part]
+        return parts, bool(parts)
     except Exception:
-        return "", False
+        return [], False
+
+# .docx本文のテキスト抽出に使用するXPathと要素名
+_W_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P = f"{_W_NAMESPACE}p"
+_W_T = f"{_W_NAMESPACE}t"
+_W_BR = f"{_W_NAMESPACE}br"
+_W_TYPE = f"{_W_NAMESPACE}type"
+# python-docx の Run.text と同じく、テキスト以外の要素を対応する文字に置き換える
+_DOCX_RUN_CHARS = {
+    f"{_W_NAMESPACE}tab": "\t",
+    f"{_W_NAMESPACE}ptab": "\t",
+    f"{_W_NAMESPACE}cr": "\n",
+    f"{_W_NAMESPACE}noBreakHyphen": "-",
+}
+# 本文直下の段落と、その段落内（ハイパーリンク内を含む）のランのみを対象とする
+_DOCX_TEXT_XPATH = " | ".join(
+    ["./w:p"]
+    + [
+        f"./w:p/{run_path}/{child}"
+        for run_path in ("w:r", "w:hyperlink/w:r")
+        for child in ("w:t", "w:tab", "w:ptab", "w:br", "w:cr", "w:noBreakHyphen")
+    ]
+)
 
 def _read_docx(file_path: Path) -> str:
     """Wordファイル(.docx)からテキストを抽出する。"""
     try:
         doc = docx.Document(file_path)
-        return "\n".join([para.text for para in doc.paragraphs]).strip()
+        # Paragraph/Runオブジェクトを生成せず、XPathで段落とテキスト要素を文書順に一括取得する
+        elements = doc.element.body.xpath(_DOCX_TEXT_XPATH)
+        paragraphs = []
+        for element in elements:
+            if element.tag == _W_P:
+                paragraphs.append([])
+            elif element.tag == _W_T:
+                paragraphs[-1].append(element.text or "")
+            elif element.tag == _W_BR:
+                # 改ページ・段区切りは文字を出力せず、行区切りのみ改行とする
+                if element.get(_W_TYPE, "textWrapping") == "textWrapping":
+                    paragraphs[-1].append("\n")
+            else:
+                paragraphs[-1].append(_DOCX_RUN_CHARS[element.tag])
+        return "\n".join("".join(parts) for parts in paragraphs).strip()
     except Exception:
         return ""
 
 def _read_text(file_path: Path) -> str:
     """
     テキストベースのファイルを読み込む。
-    複数のエンコーディング候補を試す。
+    UTF-8で読めない場合は文字コードを自動判定してデコードする。
+    改行コードは "\n" に統一する。
     """
-    encodings_to_try = ['utf-8', 'cp932', 'shift_jis', 'euc_jp']
-    
-    for encoding in encodings_to_try:
-        try:
-            with open(file_path, 'r', encoding=encoding) as f:
-                return f.read().strip()
-        except UnicodeDecodeError:
-            continue
-        except Exception:
-            return ""
+    try:
+        data = file_path.read_bytes()
+    except Exception:
+        return ""
+
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        best_match = charset_normalizer.from_bytes(data).best()
+        if best_match is not None:
+            text = str(best_match)
+        else:
+            text = data.decode("utf-8", errors="replace")
+
+    # テキストモードでの読み込みと同様に、改行コードを "\n" に統一する
+    return text.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+def _split_text(text: str, max_chars: int):
+    """
+    テキストを最大文字数以下のチャンクに分割して順に返す。
+    単語や文の途中で切れないよう、上限内で最後の段落区切り（空行）、
+    次いで改行の位置で分割し、どちらもなければ上限位置で分割する。
+    """
+    start = 0
+    length = len(text)
+    while length - start > max_chars:
+        limit = start + max_chars
+        end = text.rfind("\n\n", start, limit)
+        if end <= start:
+            end = text.rfind("\n", start, limit)
+        if end <= start:
+            end = limit
+        yield text[start:end]
+        # 区切りの改行は次のチャンクに持ち越さない
+        start = end
+        while start < length and text[start] == "\n":
+            start += 1
+    if start < length:
+        yield text[start:]
+
+# ファイル単位の処理結果のキャッシュ。(パス, 更新時刻, サイズ, 最大文字数) をキーとし、
+# 値は (処理結果, 本文の合計文字数)。プロセス内でセッションをまたいで共有する。
+# 件数と本文の合計文字数の両方に上限を設け、超えた場合は古いものから破棄する。
+# Streamlitのセッションは別スレッドで動くため、アクセスは必ずロックを取得して行う。
+_FILE_RESULT_CACHE = OrderedDict()
+_FILE_RESULT_CACHE_MAX_ENTRIES = 64
+_FILE_RESULT_CACHE_MAX_CHARS = 20_000_000
+_FILE_RESULT_CACHE_CHARS = 0
+_FILE_RESULT_CACHE_LOCK = threading.Lock()
+
+SUPPORTED_EXTENSIONS = {
+    ".pdf": _read_pdf,
+    ".docx": _read_docx,
+    ".txt": _read_text,
+    ".md": _read_text,
+    ".csv": _read_text,
+}
+
+def _scan_supported_files(folder_path: str) -> list:
+    """
+    フォルダ直下のサポート対象ファイルを os.DirEntry のリストで返す。
+    DirEntryが保持するstat情報を使い、余分なシステムコールを避ける。
+    """
+    with os.scandir(folder_path) as it:
+        return [
+            entry for entry in it
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
+        ]
+
+def _process_file(path_str: str, file_size: int) -> (list, list):
+    """
+    1ファイル分の読み込み・サニタイズ・分割を行うワーカー関数。
+    プロセスプールから呼び出されるため、モジュールトップレベルに定義する。
+    """
+    file_path = Path(path_str)
+    suffix = file_path.suffix.lower()
+    handler = SUPPORTED_EXTENSIONS[suffix]
+    documents = []
+    warnings = []
+    chunks = []
+
+    if suffix == ".pdf":
+        # PDFは抽出時にサニタイズと分割まで行われる
+        chunks, has_text = handler(file_path)
+        if not has_text and file_size > 0:
+            warnings.append(f"警告: '{file_path.name}' はテキスト情報を含まないスキャン画像PDFの可能性があります。")
+    else:
+        content = handler(file_path)
+        if content:
+            # テキストをサニタイズ
+            sanitized_content = _sanitize_text(content)
             
-    return ""
+            # 巨大なファイルを分割する処理
+            if len(sanitized_content) > config.MAX_DOCUMENT_CHARS:
+                chunks = list(_split_text(sanitized_content, config.MAX_DOCUMENT_CHARS))
+            else:
+                chunks = [sanitized_content]
+
+    if len(chunks) > 1:
+        warnings.append(f"警告: '{file_path.name}' はサイズが大きいため、複数のキャンバスに分割しました。")
+        
+        for i, chunk in enumerate(chunks):
+            documents.append({
+                "filename": f"{file_path.name} (Part {i+1})",
+                "content": chunk
+            })
+    elif chunks:
+        documents.append({
+            "filename": file_path.name,
+            "content": chunks[0]
+        })
+    elif file_size > 0:
+        warnings.append(f"警告: '{file_path.name}' からテキストを抽出できませんでした。対応していない形式か、ファイルが破損している可能性があります。")
+
+    return documents, warnings
+
+def _iter_processed_files(paths: list, sizes: list):
+    """
+    各ファイルの処理結果を元の順序で順次返す。
+    ファイル数または合計サイズが閾値を超える場合のみプロセスプールで並列に処理し、
+    先読みはワーカー数分に限定する。ワーカーの起動コスト（Windowsではspawnによる
+    モジュールの再インポート）が解析時間を上回らないよう、少量の場合は逐次処理する。
+    呼び出し側が途中で打ち切った場合、未着手のファイルは処理しない。
+    """
+    use_pool = len(paths) > 1 and (
+        len(paths) >= config.PARALLEL_LOAD_MIN_FILES
+        or sum(sizes) >= config.PARALLEL_LOAD_MIN_BYTES
+    )
+    if not use_pool:
+        for path_str, size in zip(paths, sizes):
+            yield _process_file(path_str, size)
+        return
+
+    # Streamlitの再実行で使い回さないよう、プールは呼び出しごとに生成・破棄する
+    max_workers = min(os.cpu_count() or 1, config.PARALLEL_LOAD_MAX_WORKERS, len(paths))
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        pending_args = iter(zip(paths, sizes))
+        futures = deque(
+            executor.submit(_process_file, *args) for args in islice(pending_args, max_workers)
+        )
+        while futures:
+            result = futures.popleft().result()
+            for args in islice(pending_args, 1):
+                futures.append(executor.submit(_process_file, *args))
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
 
-def load_documents(folder_path: str) -> (list, list):
+def _store_file_result(key: tuple, result: tuple):
+    """
+    ファイルの処理結果をキャッシュに格納する。
+    読み取りエラーなどの一時的な失敗を次回の読み込みで再試行できるよう、
+    文献を1件も生成しなかった結果はキャッシュしない。
+    """
+    global _FILE_RESULT_CACHE_CHARS
+    documents, _ = result
+    chars = sum(len(document["content"]) for document in documents)
+    if not documents or chars > _FILE_RESULT_CACHE_MAX_CHARS:
+        return
+
+    with _FILE_RESULT_CACHE_LOCK:
+        previous = _FILE_RESULT_CACHE.pop(key, None)
+        if previous is not None:
+            _FILE_RESULT_CACHE_CHARS -= previous[1]
+        _FILE_RESULT_CACHE[key] = (result, chars)
+        _FILE_RESULT_CACHE_CHARS += chars
+        while (len(_FILE_RESULT_CACHE) > _FILE_RESULT_CACHE_MAX_ENTRIES
+                or _FILE_RESULT_CACHE_CHARS > _FILE_RESULT_CACHE_MAX_CHARS):
+            _, (_, evicted_chars) = _FILE_RESULT_CACHE.popitem(last=False)
+            _FILE_RESULT_CACHE_CHARS -= evicted_chars
+
+def _iter_file_results(files: list):
+    """
+    (パス, サイズ, 更新時刻) のリストを受け取り、各ファイルの処理結果を元の順序で順次返す。
+    変更のないファイルはキャッシュ済みの結果を返し、それ以外のみ解析する。
+    """
+    keys = [(path_str, mtime_ns, size, config.MAX_DOCUMENT_CHARS) for path_str, size, mtime_ns in files]
+    cached = {}
+    with _FILE_RESULT_CACHE_LOCK:
+        for key in keys:
+            entry = _FILE_RESULT_CACHE.get(key)
+            if entry is not None:
+                _FILE_RESULT_CACHE.move_to_end(key)
+                cached[key] = entry[0]
+    misses = [(path_str, size) for (path_str, size, _), key in zip(files, keys) if key not in cached]
+    processed = _iter_processed_files([path_str for path_str, _ in misses], [size for _, size in misses])
+    try:
+        for key in keys:
+            if key in cached:
+                result = cached[key]
+            else:
+                result = next(processed)
+                _store_file_result(key, result)
+            # 呼び出し側での変更がキャッシュに波及しないよう、コピーを返す
+            documents, warnings = result
+            yield [dict(document) for document in documents], list(warnings)
+    finally:
+        processed.close()
+
+def load_documents(folder_path: str, max_documents: int = config.MAX_DOCUMENTS) -> (list, list):
     """
     指定されたフォルダ内のサポートドキュメントを読み込む。
     巨大なドキュメントは指定された最大文字数で分割する。
+    未キャッシュのファイル数が PARALLEL_LOAD_MIN_FILES 以上、または合計サイズが
+    PARALLEL_LOAD_MIN_BYTES 以上の場合のみプロセスプールで並列に処理し、それ以外は逐次処理する。
+    ファイル名順に処理し、最大読み込み数を超えた時点で残りのファイルの解析を打ち切る。
     """
-    path = Path(folder_path)
-    if not path.is_dir():
+    if not os.path.isdir(folder_path):
         return [], [f"エラー: 指定されたパス '{folder_path}' は有効なフォルダではありません。"]
 
-    supported_extensions = {
-        ".pdf": _read_pdf,
-        ".docx": _read_docx,
-        ".txt": _read_text,
-        ".md": _read_text,
-        ".csv": _read_text,
-    }
-
     documents = []
     warnings = []
 
-    for file_path in path.iterdir():
-        if file_path.is_file() and file_path.suffix in supported_extensions:
-            handler = supported_extensions[file_path.suffix]
-            content = ""
-            
-            if file_path.suffix == ".pdf":
-                content, has_text = handler(file_path)
-                if not has_text and file_path.stat().st_size > 0:
-                    warnings.append(f"警告: '{file_path.name}' はテキスト情報を含まないスキャン画像PDFの可能性があります。")
-            else:
-                content = handler(file_path)
-
-            if content:
-                # テキストをサニタイズ
-                sanitized_content = _sanitize_text(content)
-                
-                # 巨大なファイルを分割する処理
-                if len(sanitized_content) > config.MAX_DOCUMENT_CHARS:
-                    warnings.append(f"警告: '{file_path.name}' はサイズが大きいため、複数のキャンバスに分割しました。")
-                    
-                    chunks = [
-                        sanitized_content[i:i + config.MAX_DOCUMENT_CHARS] 
-                        for i in range(0, len(sanitized_content), config.MAX_DOCUMENT_CHARS)
-                    ]
-                    
-                    for i, chunk in enumerate(chunks):
-                        documents.append({
-                            "filename": f"{file_path.name} (Part {i+1})",
-                            "content": chunk
-                        })
-                else:
-                    documents.append({
-                        "filename": file_path.name,
-                        "content": sanitized_content
-                    })
-            elif file_path.stat().st_size > 0:
-                warnings.append(f"警告: '{file_path.name}' からテキストを抽出できませんでした。対応していない形式か、ファイルが破損している可能性があります。")
+    entries = sorted(_scan_supported_files(folder_path), key=lambda entry: entry.name)
+    files = [(entry.path, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries]
+
+    # 結果は元の順序のまま集約する
+    for file_documents, file_warnings in _iter_file_results(files):
+        documents.extend(file_documents)
+        warnings.extend(file_warnings)
+        if len(documents) > max_documents:
+            warnings.append(config.UITexts.MAX_DOCS_WARNING.format(max_docs=max_documents))
+            documents = documents[:max_documents]
+            break
 
     if not documents and not warnings:
         warnings.append("指定されたフォルダに読み込み可能なファイルが見つかりませんでした。")
         
-    return documents, warnings
\ No newline at end of file
+    return documents, warnings
@@ -1,15 +1,21 @@
 import os
 import sys
-import json
 import time
 from importlib import resources
 
 import streamlit as st
 import yaml
+import orjson
 import tiktoken
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 
+try:
+    # libyamlが利用可能であればC実装のローダーを使用する
+    from yaml import CSafeLoader as YamlSafeLoader
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader
+
 # --- ローカルモジュールのインポート ---
 try:
     # パッケージとしてインストールされている場合
@@ -22,16 +28,29 @@ except ImportError:
 
 # --- グローバル変数 ---
 PROMPTS = {}
+TOKENS_PER_MESSAGE = 4  # role等のメッセージ書式に消費されるトークン数の概算
+TOKENS_PER_REPLY = 2  # アシスタント応答の開始に消費されるトークン数
+STREAM_FLUSH_INTERVAL_SEC = 0.05  # ストリーミング表示を更新する最小間隔（秒）
+STREAM_FLUSH_CHARS = 200  # 間隔に関わらず表示を更新する未描画文字数
 
 # --- ヘルパー関数 ---
 
+@st.cache_resource(show_spinner=False)
+def _parse_prompts() -> dict:
+    """
+    prompts.yamlを解析する。
+    Streamlitは再実行ごとにこのスクリプトを新しいモジュールとして実行し直すため、
+    st.cache_resourceでプロセス内に保持し、再実行のたびに解析し直さないようにする。
+    """
+    data = resources.files("paper_analyst").joinpath("prompts.yaml").read_bytes()
+    yaml_data = yaml.load(data, Loader=YamlSafeLoader)
+    return yaml_data.get("prompts", {})
+
 def load_prompts():
     """パッケージ内のprompts.yamlを安全に読み込む"""
     global PROMPTS
     try:
-        with resources.open_text("paper_analyst", "prompts.yaml") as f:
-            yaml_data = yaml.safe_load(f)
-            PROMPTS = yaml_data.get("prompts", {})
+        PROMPTS = _parse_prompts()
     except Exception as e:
         st.error(f"重大なエラー: prompts.yamlの読み込みに失敗しました: {e}")
         st.stop()
@@ -56,12 +75,23 @@ def reset_session():
 def get_token_count(string: str, encoding_name: str = "cl100k_base") -> int:
     """tiktokenを使ってテキストのトークン数を計算する"""
     try:
-        encoding = tiktoken.get_encoding(encoding_name)
-        num_tokens = len(encoding.encode(string))
-        return num_tokens
+        return len(tiktoken.get_encoding(encoding_name).encode(string))
     except Exception:
         return len(string) // 4
 
+def get_messages_token_count(messages: list, encoding_name: str = "cl100k_base") -> int:
+    """
+    メッセージリストのトークン数を計算する。
+    JSONへシリアライズせず、各メッセージのcontentを数え、
+    OpenAIのチャット形式に従ってメッセージごと・応答開始分のオーバーヘッドを加算する。
+    """
+    try:
+        encode = tiktoken.get_encoding(encoding_name).encode
+        content_tokens = sum(len(encode(message["content"])) for message in messages)
+    except Exception:
+        content_tokens = sum(len(message["content"]) // 4 for message in messages)
+    return content_tokens + TOKENS_PER_MESSAGE * len(messages) + TOKENS_PER_REPLY
+
 def _clear_session_for_load():
     """st.rerun()を呼ばずにセッションをクリアするヘルパー関数"""
     # ★★★ 修正: キーカウンターを維持する ★★★
@@ -77,7 +107,7 @@ def _clear_session_for_load():
 def load_session_from_file(uploaded_file):
     """アップロードされたファイルオブジェクトからセッションを復元する"""
     try:
-        session_data = json.load(uploaded_file)
+        session_data = orjson.loads(uploaded_file.read())
         
         required_keys = ["messages", "loaded_documents", "selected_model"]
         if not all(key in session_data for key in required_keys):
@@ -108,6 +138,26 @@ def on_upload_change():
     if st.session_state[uploader_key] is not None:
         st.session_state.file_to_process = st.session_state[uploader_key]
 
+def _serialize_session(fingerprint: tuple, session_data: dict) -> bytes:
+    """
+    保存用のセッションJSONを生成する。
+    再実行のたびに巨大な文献データをシリアライズしないよう、軽量なフィンガープリントとともに
+    セッションステートへ保持し、フィンガープリントが変わった場合のみ再生成する。
+    （st.cache_dataは全セッションで共有されるため使用しない）
+    """
+    cached = st.session_state.get("session_download_cache")
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    # download_buttonはbytesをそのまま受け付けるため、デコードせずに返す
+    data = orjson.dumps(session_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    st.session_state.session_download_cache = (fingerprint, data)
+    return data
+
+@st.cache_resource(show_spinner=False)
+def _get_client(api_key: str, azure_endpoint: str, api_version: str) -> AzureOpenAI:
+    """接続設定ごとにAzure OpenAIクライアントを1つだけ生成し、再実行をまたいで再利用する"""
+    return AzureOpenAI(api_key=api_key, azure_endpoint=azure_endpoint, api_version=api_version)
+
 # --- UI描画関数 ---
 
 def render_sidebar():
@@ -128,9 +178,17 @@ def render_sidebar():
                 "total_usage": st.session_state.total_usage,
                 "load_warnings": st.session_state.load_warnings,
             }
+            fingerprint = (
+                id(st.session_state.loaded_documents),
+                len(st.session_state.messages),
+                st.session_state.messages[-1]["content"],
+                len(st.session_state.loaded_documents),
+                st.session_state.selected_model,
+                st.session_state.total_usage["total_tokens"],
+            )
             st.download_button(
                 label=config.UITexts.DOWNLOAD_SESSION_BUTTON,
-                data=json.dumps(session_data, ensure_ascii=False, indent=2),
+                data=_serialize_session(fingerprint, session_data),
                 file_name=f"session_{int(time.time())}.json",
                 mime="application/json",
                 use_container_width=True
@@ -148,9 +206,20 @@ def render_sidebar():
 
         if st.session_state.app_status == "READY":
             st.subheader(config.UITexts.LOADED_CONTENT_HEADER)
-            for i, doc in enumerate(st.session_state.loaded_documents):
-                with st.expander(f"Canvas-{i+1}: {doc['filename']}"):
-                    st.text_area(f"canvas_display_{i}", value=doc['content'], height=200, disabled=True, key=f"canvas_text_{i}")
+            # 選択中の文献のみ本文をブラウザへ送信する
+            loaded_documents = st.session_state.loaded_documents
+            if loaded_documents:
+                selected_index = st.selectbox(
+                    "canvas_selector",
+                    options=range(len(loaded_documents)),
+                    format_func=lambda i: f"Canvas-{i+1}: {loaded_documents[i]['filename']}",
+                    label_visibility="collapsed",
+                    key="canvas_selector",
+                )
+                st.text_area(
+                    "canvas_display", value=loaded_documents[selected_index]['content'], height=200,
+                    disabled=True, label_visibility="collapsed", key=f"canvas_text_{selected_index}"
+                )
             
             if st.session_state.load_warnings:
                 st.subheader(config.UITexts.WARNINGS_HEADER)
@@ -269,12 +338,11 @@ def run_app():
 
     elif st.session_state.app_status == "LOADING":
         with st.spinner(config.UITexts.LOADING_SPINNER):
-            docs, warnings = document_loader.load_documents(st.session_state.folder_path)
-            if len(docs) > config.MAX_DOCUMENTS:
-                warnings.append(config.UITexts.MAX_DOCS_WARNING.format(max_docs=config.MAX_DOCUMENTS))
-                st.session_state.loaded_documents = docs[:config.MAX_DOCUMENTS]
-            else:
-                st.session_state.loaded_documents = docs
+            # 変更のないファイルは document_loader 側のファイル単位キャッシュから再利用される
+            docs, warnings = document_loader.load_documents(
+                st.session_state.folder_path, max_documents=config.MAX_DOCUMENTS
+            )
+            st.session_state.loaded_documents = docs
             st.session_state.load_warnings = warnings
             st.session_state.app_status = "READY"
         st.success(config.UITexts.LOADING_DONE)
@@ -307,9 +375,7 @@ def run_app():
             st.stop()
 
         try:
-            client = AzureOpenAI(
-                api_key=env_vars['api_key'], azure_endpoint=env_vars['azure_endpoint'], api_version=env_vars['api_version']
-            )
+            client = _get_client(env_vars['api_key'], env_vars['azure_endpoint'], env_vars['api_version'])
         except Exception as e:
             st.error(config.UITexts.CLIENT_INIT_ERROR.format(e=e))
             st.stop()
@@ -320,36 +386,36 @@ def run_app():
             render_chat_interface()
 
             if st.session_state.is_generating:
-                context_texts = []
-                for i, doc in enumerate(st.session_state.loaded_documents):
-                    if doc['filename'] in st.session_state.get('selected_docs', []):
-                        context_texts.append(
-                            f"### 参考資料 (Canvas-{i+1}: {doc['filename']})\n{doc['content']}"
-                        )
-                combined_context = "\n\n---\n\n".join(context_texts)
+                selected = frozenset(st.session_state.get('selected_docs', ()))
+                combined_context = "\n\n---\n\n".join(
+                    f"### 参考資料 (Canvas-{i+1}: {doc['filename']})\n{doc['content']}"
+                    for i, doc in enumerate(st.session_state.loaded_documents)
+                    if doc['filename'] in selected
+                )
 
-                messages_for_api = [msg.copy() for msg in st.session_state.messages]
-                last_user_message = messages_for_api[-1]["content"]
+                last_user_message = st.session_state.messages[-1]["content"]
                 
                 contextual_prompt = (
                     f"{combined_context}\n\n---\n\n"
                     f"上記の参考資料に基づいて、以下の質問に答えてください。\n\n"
                     f"質問: {last_user_message}"
                 )
-                messages_for_api[-1]["content"] = contextual_prompt
+                # 過去のメッセージは読み取りのみのため、コピーせずに最後の質問だけ差し替える
+                messages_for_api = st.session_state.messages[:-1] + [{"role": "user", "content": contextual_prompt}]
                 
                 if st.session_state.get("debug_mode", False):
                     with st.expander(config.UITexts.DEBUG_PROMPT_HEADER, expanded=False):
-                        st.text(json.dumps(messages_for_api, indent=2, ensure_ascii=False))
+                        st.text(orjson.dumps(messages_for_api, option=orjson.OPT_INDENT_2).decode())
 
                 with st.chat_message("assistant"):
                     placeholder = st.empty()
                     full_response = ""
                     input_tokens = 0
+                    last_flush = time.monotonic()
+                    flushed_length = 0
                     
                     try:
-                        messages_json_string = json.dumps(messages_for_api)
-                        input_tokens = get_token_count(messages_json_string)
+                        input_tokens = get_messages_token_count(messages_for_api)
 
                         if input_tokens > max_input_tokens:
                             raise ValueError(
@@ -367,7 +433,13 @@ def run_app():
                             
                             if chunk.choices and chunk.choices[0].delta.content is not None:
                                 full_response += chunk.choices[0].delta.content
-                                placeholder.markdown(full_response + "▌")
+                                # 一定時間または一定文字数ごとにまとめて描画する
+                                now = time.monotonic()
+                                if (now - last_flush >= STREAM_FLUSH_INTERVAL_SEC
+                                        or len(full_response) - flushed_length >= STREAM_FLUSH_CHARS):
+                                    placeholder.markdown(full_response + "▌")
+                                    last_flush = now
+                                    flushed_length = len(full_response)
                     
                     except ValueError as ve:
                         st.error(str(ve))